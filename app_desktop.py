@@ -12,6 +12,12 @@ import ctypes
 import traceback
 import warnings
 import shutil
+import json
+import hashlib
+import struct
+import threading
+from collections import OrderedDict, deque
+from contextlib import contextmanager, nullcontext
 
 # Import Pydub (Used only for the Mixer export now)
 from pydub import AudioSegment
@@ -64,6 +70,98 @@ def get_base_path():
 def resource_path(relative_path): return os.path.join(get_base_path(), relative_path)
 DB_PATH = os.path.join(get_base_path(), "audio.db")
 
+# --- DATABASE ---
+def create_schema(db_path):
+    conn = sqlite3.connect(db_path)
+    cur = conn.cursor()
+    cur.execute("CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT, path TEXT UNIQUE, folder TEXT, tags TEXT, duration REAL, size INTEGER)")
+    try: cur.execute("SELECT folder FROM files LIMIT 1")
+    except: cur.execute("ALTER TABLE files ADD COLUMN folder TEXT")
+    try: cur.execute("SELECT samplerate, decodable FROM files LIMIT 1")
+    except:
+        cur.execute("ALTER TABLE files ADD COLUMN samplerate INTEGER")
+        cur.execute("ALTER TABLE files ADD COLUMN decodable INTEGER DEFAULT 1")
+        cur.execute("UPDATE files SET decodable = 0 WHERE tags = 'Scan Error'")
+    conn.commit()
+    conn.close()
+
+# --- PROFILER ---
+# Enable with RNDSND_PROFILE=1. RNDSND_PROFILE_OUT=<file.json> also dumps a Chrome trace on exit.
+class Profiler:
+    """Thread-safe timing spans and counters for the hot paths (scan, load, mix)."""
+    def __init__(self, enabled=False, max_samples=10000, max_events=200000):
+        self.enabled = enabled
+        self.max_samples = max_samples
+        self.lock = threading.Lock()
+        self.t0 = time.perf_counter()
+        # name -> [count, total_sec, deque of recent durations, bytes, first start, last end]
+        self.stages = {}
+        self.counters = {}
+        self.events = deque(maxlen=max_events)
+
+    def span(self, name, nbytes=0):
+        return self._span(name, nbytes) if self.enabled else nullcontext()
+
+    @contextmanager
+    def _span(self, name, nbytes):
+        start = time.perf_counter()
+        try: yield
+        finally: self.record(name, start, time.perf_counter(), nbytes)
+
+    def record(self, name, start, end, nbytes=0):
+        if not self.enabled: return
+        dur = end - start
+        with self.lock:
+            st = self.stages.get(name)
+            if st is None: st = self.stages[name] = [0, 0.0, deque(maxlen=self.max_samples), 0, start, end]
+            st[0] += 1; st[1] += dur; st[2].append(dur); st[3] += nbytes
+            st[4] = min(st[4], start); st[5] = max(st[5], end)
+            self.events.append((name, start, dur, threading.get_ident()))
+
+    def count(self, name, n=1):
+        if not self.enabled: return
+        with self.lock: self.counters[name] = self.counters.get(name, 0) + n
+
+    def reset(self):
+        with self.lock:
+            self.stages.clear(); self.counters.clear(); self.events.clear()
+            self.t0 = time.perf_counter()
+
+    def summary(self):
+        def pct(sorted_vals, q): return sorted_vals[min(len(sorted_vals) - 1, int(q * len(sorted_vals)))]
+        with self.lock:
+            stages = {}
+            for name, (n, total, recent, nbytes, first, last) in self.stages.items():
+                vals = sorted(recent)
+                # Throughput is over the stage's wall-clock window (first start to last end),
+                # so idle gaps and parallel workers are accounted for
+                wall = last - first
+                stages[name] = {
+                    "count": n,
+                    "total_s": total,
+                    "wall_s": wall,
+                    "mean_ms": 1000 * total / n,
+                    "p50_ms": 1000 * pct(vals, 0.50),
+                    "p95_ms": 1000 * pct(vals, 0.95),
+                    "per_sec": n / wall if wall > 0 else 0.0,
+                    "bytes": nbytes,
+                    "mb_per_sec": nbytes / (1024 * 1024) / wall if wall > 0 else 0.0,
+                }
+            return {"stages": stages, "counters": dict(self.counters)}
+
+    def chrome_trace(self):
+        with self.lock: events = list(self.events)
+        return {"traceEvents": [
+            {"name": name, "cat": name.split(".")[0], "ph": "X", "pid": os.getpid(), "tid": tid,
+             "ts": (start - self.t0) * 1e6, "dur": dur * 1e6}
+            for name, start, dur, tid in events]}
+
+    def export(self, path, fmt="json"):
+        data = self.chrome_trace() if fmt == "trace" else self.summary()
+        with open(path, "w", encoding="utf-8") as f: json.dump(data, f, indent=1)
+
+PROFILER = Profiler(enabled=os.environ.get("RNDSND_PROFILE", "") not in ("", "0"))
+
 # --- INTELLIGENT SCANNER (MULTI-SAMPLE) ---
 class ScanWorker(QThread):
     progress = Signal(int)
@@ -81,10 +179,12 @@ class ScanWorker(QThread):
         
         valid_exts = ('.wav', '.mp3', '.flac', '.aiff', '.ogg', '.m4a', '.wma', '.aac', '.opus', '.aif')
         file_list = []
-        for root, dirs, files in os.walk(self.folder):
-            for f in files:
-                if f.lower().endswith(valid_exts):
-                    file_list.append(os.path.join(root, f))
+        with PROFILER.span("scan.walk"):
+            for root, dirs, files in os.walk(self.folder):
+                for f in files:
+                    if f.lower().endswith(valid_exts):
+                        file_list.append(os.path.join(root, f))
+        PROFILER.count("scan.files_found", len(file_list))
         
         total = len(file_list)
         if total == 0:
@@ -102,6 +202,7 @@ class ScanWorker(QThread):
             # Check if file exists
             cur.execute("SELECT id FROM files WHERE path = ?", (path,))
             if cur.fetchone():
+                PROFILER.count("scan.files_skipped")
                 if i % 10 == 0: self.progress.emit(int((i / total) * 100))
                 continue
 
@@ -115,10 +216,15 @@ class ScanWorker(QThread):
 
             tags = "Unknown"
             duration = 0.0
+            samplerate = 0
+            size = 0
+            t_file = time.perf_counter()
             
             try:
-                duration = librosa.get_duration(path=path)
                 size = os.path.getsize(path)
+                with PROFILER.span("scan.probe"):
+                    duration = librosa.get_duration(path=path)
+                    samplerate = librosa.get_samplerate(path)
 
                 if self.ai_model:
                     chunk_dur = 5.0
@@ -134,14 +240,19 @@ class ScanWorker(QThread):
 
                     for off in offsets:
                         # FIX: PADDING ERROR
-                        y, _ = librosa.load(path, sr=32000, mono=True, offset=off, duration=chunk_dur)
+                        with PROFILER.span("scan.decode"):
+                            y, native_sr = librosa.load(path, sr=None, mono=True, offset=off, duration=chunk_dur)
+                        if native_sr != 32000:
+                            with PROFILER.span("scan.resample"):
+                                y = librosa.resample(y, orig_sr=native_sr, target_sr=32000)
                         min_samples = 32000 
                         if len(y) < min_samples:
                             pad_width = min_samples - len(y)
                             y = np.pad(y, (0, pad_width), mode='constant')
 
                         y = y[None, :]
-                        clipwise_output, _ = self.ai_model.inference(y)
+                        with PROFILER.span("scan.inference"):
+                            clipwise_output, _ = self.ai_model.inference(y)
                         scores = clipwise_output[0]
                         
                         for idx, score in enumerate(scores):
@@ -158,23 +269,412 @@ class ScanWorker(QThread):
                 else:
                     tags = "No AI"
 
-                cur.execute("INSERT OR IGNORE INTO files (filename, path, folder, tags, size, duration) VALUES (?, ?, ?, ?, ?, ?)",
-                            (filename, path, os.path.dirname(path), tags, size, duration))
-                conn.commit()
+                with PROFILER.span("scan.db_write"):
+                    cur.execute("INSERT OR IGNORE INTO files (filename, path, folder, tags, size, duration, samplerate, decodable) VALUES (?, ?, ?, ?, ?, ?, ?, 1)",
+                                (filename, path, os.path.dirname(path), tags, size, duration, samplerate))
+                    conn.commit()
                 new_files += 1
+                PROFILER.count("scan.files_analyzed")
+                PROFILER.count("scan.bytes", size)
+                PROFILER.record("scan.file", t_file, time.perf_counter(), size)
                 
                 self.progress.emit(int((i / total) * 100))
                 self.log.emit(f"Analyzed: {filename[:15]}... [{tags}]")
                 
             except Exception as e: 
                 print(f"Error analyzing {filename}: {e}")
-                cur.execute("INSERT OR IGNORE INTO files (filename, path, folder, tags, size, duration) VALUES (?, ?, ?, ?, ?, ?)",
-                            (filename, path, os.path.dirname(path), "Scan Error", size, duration))
+                PROFILER.count("scan.errors")
+                cur.execute("INSERT OR IGNORE INTO files (filename, path, folder, tags, size, duration, samplerate, decodable) VALUES (?, ?, ?, ?, ?, ?, ?, 0)",
+                            (filename, path, os.path.dirname(path), "Scan Error", size, duration, samplerate))
                 conn.commit()
         
         conn.close()
         self.finished.emit(new_files)
 
+# --- MIXER CANDIDATE INDEX ---
+GRAIN_SIZES = {
+    "Micro (0.2s - 2s)": (200, 2000),
+    "Short (2s - 5s)": (2000, 5000),
+    "Medium (5s - 15s)": (5000, 15000),
+    "Long (15s - 30s)": (15000, 30000),
+    "Extra Long (30s - 60s)": (30000, 60000),
+}
+
+PICK_WEIGHTINGS = ["Uniform", "Duration", "Tag Match", "Folder Balance"]
+
+def like_pattern(text):
+    return "%" + text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+class MixCandidateIndex:
+    """Mixer source list built from the DB: only decodable files long enough for the grain,
+    picked with precomputed cumulative weights."""
+    def __init__(self, rows, min_sec=0.0, weighting="Uniform", search_text=""):
+        # rows: (path, folder, tags, duration, samplerate)
+        usable = [r for r in rows if r[3] and r[3] > 0]
+        long_enough = [r for r in usable if r[3] >= min_sec]
+        # Nothing long enough for this grain: fall back to whole short files
+        self.rows = long_enough or usable
+        self.paths = [r[0] for r in self.rows]
+        self.durations = {r[0]: r[3] for r in self.rows}
+        self.weights = self.compute_weights(weighting, search_text)
+        self.rebuild()
+
+    @classmethod
+    def from_db(cls, db_path, folder=None, search_text="", min_sec=0.0, weighting="Uniform", tag_text=None):
+        # tag_text only drives "Tag Match" weighting (defaults to the filter text); it never filters rows
+        query = "SELECT path, folder, tags, duration, samplerate FROM files WHERE IFNULL(decodable, 1) != 0"
+        params = []
+        if folder:
+            query += " AND path LIKE ? ESCAPE '\\'"
+            params.append(like_pattern(folder)[1:])
+        if search_text:
+            query += " AND (filename LIKE ? ESCAPE '\\' OR tags LIKE ? ESCAPE '\\')"
+            params += [like_pattern(search_text)] * 2
+        conn = sqlite3.connect(db_path)
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+        return cls(rows, min_sec, weighting, search_text if tag_text is None else tag_text)
+
+    def compute_weights(self, weighting, search_text):
+        if weighting == "Duration":
+            # sqrt keeps hour-long recordings from drowning everything else
+            return [max(r[3], 0.1) ** 0.5 for r in self.rows]
+        if weighting == "Tag Match" and search_text:
+            words = search_text.lower().split()
+            return [1.0 + sum(w in (r[2] or "").lower() for w in words) for r in self.rows]
+        if weighting == "Folder Balance":
+            per_folder = {}
+            for r in self.rows: per_folder[r[1]] = per_folder.get(r[1], 0) + 1
+            return [1.0 / per_folder[r[1]] for r in self.rows]
+        return [1.0] * len(self.rows)
+
+    def rebuild(self):
+        self.cum_weights = []
+        total = 0.0
+        for w in self.weights:
+            total += w
+            self.cum_weights.append(total)
+
+    def __len__(self): return len(self.paths)
+
+    def pick(self):
+        return random.choices(self.paths, cum_weights=self.cum_weights)[0]
+
+    def mark_bad(self, path):
+        """Drops a file that failed to decode from this index only.
+
+        Not persisted: failures are often environmental (missing ffmpeg, unmounted drive).
+        """
+        if path in self.durations:
+            i = self.paths.index(path)
+            del self.paths[i], self.weights[i], self.rows[i]
+            del self.durations[path]
+            self.rebuild()
+
+    def random_clip(self, path, min_ms, max_ms):
+        """Chooses (start_ms, clip_ms) inside the file using the indexed duration."""
+        total_ms = int(self.durations[path] * 1000)
+        clip_len = random.randint(min_ms, max_ms)
+        if total_ms <= clip_len: return 0, total_ms
+        return random.randint(0, total_ms - clip_len), clip_len
+
+def load_grain(path, start_ms, clip_ms):
+    # Decode only the needed window instead of the whole file
+    t = time.perf_counter()
+    seg = AudioSegment.from_file(path, start_second=start_ms / 1000.0, duration=clip_ms / 1000.0)
+    PROFILER.record("mix.grain_decode", t, time.perf_counter(), len(seg.raw_data))
+    if len(seg) == 0: raise ValueError("empty grain")
+    return seg
+
+# --- AUDIO BUFFER ---
+# (format tag, bits) -> numpy dtype for WAV sample data we can map directly.
+# 'i3' (24-bit) has no numpy dtype: it is mapped as packed bytes and assembled per slice.
+WAV_DTYPES = {(1, 8): 'u1', (1, 16): '<i2', (1, 24): '<i3', (1, 32): '<i4', (3, 32): '<f4', (3, 64): '<f8'}
+# (AIFC compression, bits) -> numpy dtype. Plain AIFF is 'NONE'.
+AIFF_DTYPES = {(b'NONE', 8): 'i1', (b'NONE', 16): '>i2', (b'NONE', 24): '>i3', (b'NONE', 32): '>i4',
+               (b'sowt', 16): '<i2', (b'sowt', 24): '<i3', (b'sowt', 32): '<i4',
+               (b'fl32', 32): '>f4', (b'FL32', 32): '>f4', (b'fl64', 64): '>f8'}
+SUBTYPES = {'u1': 'PCM_U8', 'i1': 'PCM_S8', 'i2': 'PCM_16', 'i3': 'PCM_24', 'i4': 'PCM_32', 'f4': 'FLOAT', 'f8': 'DOUBLE'}
+
+def wav_layout(f):
+    """Returns (dtype, channels, samplerate, data_offset, data_bytes) or None if not mappable."""
+    riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+    if riff != b'RIFF' or wave != b'WAVE': return None
+    fmt = None
+    while True:
+        hdr = f.read(8)
+        if len(hdr) < 8: return None
+        cid, size = struct.unpack('<4sI', hdr)
+        if cid == b'fmt ':
+            body = f.read(size + size % 2)
+            tag, ch, sr, _, _, bits = struct.unpack('<HHIIHH', body[:16])
+            if tag == 0xFFFE and len(body) >= 26: tag = struct.unpack('<H', body[24:26])[0]  # WAVE_FORMAT_EXTENSIBLE
+            fmt = (WAV_DTYPES.get((tag, bits)), ch, sr)
+        elif cid == b'data':
+            if fmt is None or fmt[0] is None: return None
+            return fmt[0], fmt[1], fmt[2], f.tell(), size
+        else: f.seek(size + size % 2, 1)
+
+def aiff_layout(f):
+    form, _, kind = struct.unpack('>4sI4s', f.read(12))
+    if form != b'FORM' or kind not in (b'AIFF', b'AIFC'): return None
+    comm = None
+    while True:
+        hdr = f.read(8)
+        if len(hdr) < 8: return None
+        cid, size = struct.unpack('>4sI', hdr)
+        if cid == b'COMM':
+            body = f.read(size + size % 2)
+            ch, _, bits = struct.unpack('>HIH', body[:8])
+            exp, mant = struct.unpack('>HQ', body[8:18])  # 80-bit extended sample rate
+            sr = int(round(mant * 2.0 ** ((exp & 0x7FFF) - 16383 - 63)))
+            comp = body[18:22] if kind == b'AIFC' else b'NONE'
+            comm = (AIFF_DTYPES.get((comp, bits)), ch, sr)
+        elif cid == b'SSND':
+            if comm is None or comm[0] is None: return None
+            offset, _ = struct.unpack('>II', f.read(8))
+            return comm[0], comm[1], comm[2], f.tell() + offset, size - 8 - offset
+        else: f.seek(size + size % 2, 1)
+
+class AudioBuffer:
+    """Read-only (frames, channels) view of an audio file, backed by a memmap.
+
+    Uncompressed WAV/AIFF/raw PCM is mapped in place, in its native sample format.
+    Anything else is decoded once into a temporary float32 memmap. Nothing is ever
+    loaded whole: read() and peaks() convert only the slice asked for.
+    """
+    def __init__(self, data, samplerate, subtype=None, temp_path=None, int24=None):
+        # int24: '<' or '>' when data is packed 24-bit PCM, shaped (frames, channels, 3) uint8
+        self.data = data
+        self.samplerate = samplerate
+        self.frames, self.channels = data.shape[:2]
+        self.duration = self.frames / samplerate
+        self.subtype = subtype
+        self.temp_path = temp_path
+        self.mapped = temp_path is None
+        self.int24 = int24
+        kind, size = data.dtype.kind, (3 if int24 else data.dtype.itemsize)
+        self.scale = 1.0 / (1 << (8 * size - 1)) if kind in 'iu' else 1.0
+
+    @classmethod
+    def from_raw(cls, path, samplerate, channels, dtype, offset=0, nbytes=None):
+        if not isinstance(dtype, str): dtype = np.dtype(dtype).str
+        int24 = dtype[0] if dtype in ('<i3', '>i3') else None
+        itemsize = 3 if int24 else np.dtype(dtype).itemsize
+        avail = os.path.getsize(path) - offset
+        nbytes = avail if nbytes is None else min(nbytes, avail)
+        frames = nbytes // (itemsize * channels)
+        if frames <= 0: raise ValueError("no audio frames")
+        if int24: data = np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(frames, channels, 3))
+        else: data = np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=(frames, channels))
+        return cls(data, samplerate, SUBTYPES.get(dtype.lstrip('<>=|')), int24=int24)
+
+    @classmethod
+    def decode(cls, path):
+        fd, tmp = tempfile.mkstemp(prefix="rndsnd_buf_", suffix=".f32")
+        os.close(fd)
+        try:
+            try:
+                with sf.SoundFile(path) as f:
+                    sr, ch, frames, subtype = f.samplerate, f.channels, f.frames, f.subtype
+                    if frames <= 0: raise ValueError("no audio frames")
+                    mm = np.memmap(tmp, dtype=np.float32, mode='w+', shape=(frames, ch))
+                    pos = 0
+                    for block in f.blocks(blocksize=65536, dtype='float32', always_2d=True):
+                        n = min(len(block), frames - pos)
+                        mm[pos:pos + n] = block[:n]; pos += n
+                        if pos >= frames: break
+                    frames = pos
+            except (sf.LibsndfileError, RuntimeError):
+                # Formats libsndfile can't open (m4a, wma...): librosa/audioread, one full decode
+                y, sr = librosa.load(path, sr=None, mono=False)
+                y = np.atleast_2d(y).T
+                frames, ch = y.shape
+                subtype = None
+                mm = np.memmap(tmp, dtype=np.float32, mode='w+', shape=y.shape)
+                mm[:] = y; del y
+            mm.flush(); del mm
+            data = np.memmap(tmp, dtype=np.float32, mode='r', shape=(frames, ch))
+        except Exception:
+            os.remove(tmp)
+            raise
+        return cls(data, sr, subtype, temp_path=tmp)
+
+    def channel(self, c):
+        """Zero-copy view of one channel, in the file's sample format (packed (frames, 3) bytes for 24-bit)."""
+        return self.data[:, c]
+
+    def read(self, start=0, stop=None, channels=None, dtype=np.float32):
+        """Returns frames [start, stop) as a (n, channels) float array in [-1, 1]."""
+        block = self.data[max(0, start):stop]
+        if channels is not None: block = block[:, channels]
+        if self.int24:
+            # Assemble only this slice: 3 bytes -> int32, sign-extended by the arithmetic shift
+            b = block.astype(np.int32)
+            lo, hi = (b[..., 0], b[..., 2]) if self.int24 == '<' else (b[..., 2], b[..., 0])
+            out = (((lo | (b[..., 1] << 8) | (hi << 16)) << 8) >> 8).astype(dtype)
+        else:
+            out = block.astype(dtype)
+            if self.data.dtype.kind == 'u': out -= 128
+        if self.scale != 1.0: out *= self.scale
+        return out
+
+    def peaks(self, n_bins, start=0, stop=None, mono=False):
+        """Min/max envelope of [start, stop) in about n_bins bins, computed chunk by chunk."""
+        start = max(0, start)
+        stop = self.frames if stop is None else min(stop, self.frames)
+        n = stop - start
+        out_ch = 1 if mono else self.channels
+        if n <= 0 or n_bins <= 0: return np.zeros((0, out_ch), np.float32), np.zeros((0, out_ch), np.float32)
+        spb = -(-n // n_bins)
+        chunk = spb * max(1, (1 << 20) // spb)
+        mins, maxs = [], []
+        for s in range(start, stop, chunk):
+            x = self.read(s, min(s + chunk, stop))
+            if mono: x = x.mean(axis=1, keepdims=True)
+            pad = (-len(x)) % spb
+            if pad: x = np.concatenate([x, np.repeat(x[-1:], pad, axis=0)])
+            x = x.reshape(-1, spb, out_ch)
+            mins.append(x.min(axis=1)); maxs.append(x.max(axis=1))
+        return np.concatenate(mins), np.concatenate(maxs)
+
+    def close(self):
+        self.data = None
+        if getattr(self, 'temp_path', None):
+            try: os.remove(self.temp_path)
+            except OSError: pass
+            self.temp_path = None
+
+    def __del__(self): self.close()
+
+def open_audio_buffer(path):
+    """Maps uncompressed WAV/AIFF in place, decodes everything else to a temporary memmap."""
+    try:
+        with open(path, 'rb') as f:
+            magic = f.read(12); f.seek(0)
+            if magic[:4] == b'RIFF': layout = wav_layout(f)
+            elif magic[:4] == b'FORM': layout = aiff_layout(f)
+            else: layout = None
+        if layout:
+            dtype, ch, sr, offset, nbytes = layout
+            return AudioBuffer.from_raw(path, sr, ch, dtype, offset, nbytes)
+    except (OSError, struct.error, ValueError) as e:
+        print(f"⚠️ Cannot map {os.path.basename(path)}, decoding instead: {e}")
+    return AudioBuffer.decode(path)
+
+# --- DRAG EXPORT CACHE ---
+def render_clip(key, out_path, buffer, cancel=None):
+    """Writes frames [start, stop) of the buffer to a WAV, keeping native rate and channels.
+
+    Returns None (and leaves nothing behind) if the cancel event is set between blocks.
+    """
+    _, start, stop = key
+    subtype = buffer.subtype if buffer.subtype and sf.check_format('WAV', buffer.subtype) else 'FLOAT'
+    # float32 can't hold 32-bit PCM exactly
+    dtype = np.float64 if subtype in ('PCM_32', 'DOUBLE') else np.float32
+    block = 1 << 16
+
+    # Write to a private temp name, then swap in atomically (the drag may race the background render)
+    fd, part = tempfile.mkstemp(dir=os.path.dirname(out_path), suffix=".part")
+    os.close(fd)
+    try:
+        # Streamed block by block: a full-file export never holds more than one block in RAM
+        with sf.SoundFile(part, 'w', buffer.samplerate, buffer.channels, subtype=subtype, format='WAV') as out:
+            for s in range(start, stop, block):
+                if cancel is not None and cancel.is_set(): break
+                out.write(buffer.read(s, min(s + block, stop), dtype=dtype))
+        if cancel is not None and cancel.is_set():
+            os.remove(part)
+            return None
+        os.replace(part, out_path)
+    except Exception:
+        if os.path.exists(part): os.remove(part)
+        raise
+    return out_path
+
+class ClipCache:
+    """Bounded LRU of rendered drag clips (by count and total bytes). Evicted files are deleted from disk."""
+    def __init__(self, max_items=16, max_bytes=512 * 1024 * 1024):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.folder = tempfile.mkdtemp(prefix="rndsnd_clips_")
+        self.items = OrderedDict()   # key -> (path, size)
+        self.total_bytes = 0
+        # A clip bigger than the whole budget is kept on its own so it can't flush every other clip
+        self.oversized = None        # (key, path)
+
+    def clip_path(self, key):
+        path, start, stop = key
+        # The stem is only for readability in the DAW; the hash keeps same-named files apart
+        stem = os.path.splitext(os.path.basename(path))[0]
+        digest = hashlib.sha1(path.encode("utf-8", "surrogateescape")).hexdigest()[:8]
+        return os.path.join(self.folder, f"rnd_{stem}_{digest}_{start}-{stop}.wav")
+
+    def get(self, key):
+        if self.oversized and self.oversized[0] == key and os.path.exists(self.oversized[1]):
+            return self.oversized[1]
+        entry = self.items.get(key)
+        if entry and os.path.exists(entry[0]):
+            self.items.move_to_end(key)
+            return entry[0]
+        self.discard(key)
+        return None
+
+    def put(self, key, tp):
+        self.discard(key, delete=False)
+        try: size = os.path.getsize(tp)
+        except OSError: return
+        if size > self.max_bytes:
+            if self.oversized and self.oversized[1] != tp:
+                try: os.remove(self.oversized[1])
+                except OSError: pass
+            self.oversized = (key, tp)
+            return
+        self.items[key] = (tp, size)
+        self.total_bytes += size
+        # Always keep the newest clip, even if it alone exceeds the budget
+        while len(self.items) > 1 and (len(self.items) > self.max_items or self.total_bytes > self.max_bytes):
+            self.discard(next(iter(self.items)))
+
+    def discard(self, key, delete=True):
+        entry = self.items.pop(key, None)
+        if entry is None: return
+        self.total_bytes -= entry[1]
+        if delete:
+            try: os.remove(entry[0])
+            except OSError: pass
+
+    def clear(self):
+        self.items.clear()
+        self.total_bytes = 0
+        self.oversized = None
+        shutil.rmtree(self.folder, ignore_errors=True)
+
+class ClipRenderWorker(QThread):
+    rendered = Signal(object, str)
+    failed = Signal(object)
+
+    def __init__(self, key, out_path, buffer):
+        super().__init__()
+        self.key = key
+        self.out_path = out_path
+        self.buffer = buffer
+        self.cancelled = threading.Event()
+
+    def cancel(self): self.cancelled.set()
+
+    def run(self):
+        try:
+            with PROFILER.span("drag.render"):
+                tp = render_clip(self.key, self.out_path, self.buffer, self.cancelled)
+            if tp: self.rendered.emit(self.key, tp)
+        except Exception as e:
+            print(f"⚠️ Clip render failed: {e}")
+            self.failed.emit(self.key)
+        finally:
+            # Don't keep a (possibly huge, temp-backed) buffer alive after the render
+            self.buffer = None
+
 # --- STYLES ---
 COMMON_BUTTON_STYLE = """
     QPushButton { background-color: #e65100; color: #ffffff; border-radius: 4px; padding: 8px; font-weight: bold; border: none; } 
@@ -212,9 +712,18 @@ DARK_STYLE = COMMON_BUTTON_STYLE + """
 class DragButton(QPushButton):
     def __init__(self, title, parent=None):
         super().__init__(title, parent)
-        self.setAcceptDrops(False); self.main_window = None
+        self.setAcceptDrops(False); self.main_window = None; self.press_pos = None
+    def mousePressEvent(self, e):
+        if e.button() == Qt.LeftButton: self.press_pos = e.position().toPoint()
+        super().mousePressEvent(e)
     def mouseMoveEvent(self, e):
-        if e.buttons() == Qt.LeftButton and self.main_window: self.main_window.start_drag_operation()
+        # One drag per press, and only once the pointer has really moved
+        if e.buttons() == Qt.LeftButton and self.main_window and self.press_pos is not None:
+            if (e.position().toPoint() - self.press_pos).manhattanLength() >= QApplication.startDragDistance():
+                self.press_pos = None
+                self.main_window.start_drag_operation()
+                self.setDown(False)
+                return
         super().mouseMoveEvent(e)
 
 class RndSndApp(QMainWindow):
@@ -229,16 +738,24 @@ class RndSndApp(QMainWindow):
         self.audio_output = QAudioOutput()
         self.player.setAudioOutput(self.audio_output)
         self.audio_output.setVolume(1.0)
-        self.audio_data = None
+        self.audio_buffer = None
         self.sr = 44100
         self.duration = 0.0
         self.selection_range = (0, 0)
         self.is_looping = False
         self.playhead_line = None
         self.current_browsing_path = ""
+        self.current_file = None
         
         self.timer = QTimer()
         self.timer.timeout.connect(self.update_playhead_and_loop)
+
+        # Drag export: clips are pre-rendered in the background when the selection settles
+        self.clip_cache = ClipCache()
+        self.clip_worker = None
+        self.clip_timer = QTimer()
+        self.clip_timer.setSingleShot(True)
+        self.clip_timer.timeout.connect(self.prerender_drag_clip)
         
         # Main Layout
         self.central_widget = QWidget()
@@ -251,17 +768,11 @@ class RndSndApp(QMainWindow):
         
         self.setup_explorer_tab()
         self.setup_mixer_tab()
+        if PROFILER.enabled: self.setup_diagnostics_tab()
         
         self.switch_theme("Dark")
 
-    def init_db(self):
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-        cur.execute("CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY AUTOINCREMENT, filename TEXT, path TEXT UNIQUE, folder TEXT, tags TEXT, duration REAL, size INTEGER)")
-        try: cur.execute("SELECT folder FROM files LIMIT 1")
-        except: cur.execute("ALTER TABLE files ADD COLUMN folder TEXT")
-        conn.commit()
-        conn.close()
+    def init_db(self): create_schema(DB_PATH)
 
     def setup_header(self):
         header = QHBoxLayout()
@@ -285,7 +796,7 @@ class RndSndApp(QMainWindow):
             self.canvas_bg, self.wf_color, self.cursor_color = 'white', '#ff9800', 'black'
             text_color = "black"
             
-        if self.audio_data is not None: self.plot_waveform()
+        if self.audio_buffer is not None: self.plot_waveform()
         
         for row in range(self.file_table.rowCount()):
             item = self.file_table.item(row, 0)
@@ -418,9 +929,14 @@ class RndSndApp(QMainWindow):
         
         h_params.addWidget(QLabel("Clip Size:"))
         self.combo_grain = QComboBox()
-        self.combo_grain.addItems(["Micro (0.2s - 2s)", "Short (2s - 5s)", "Medium (5s - 15s)", "Long (15s - 30s)", "Extra Long (30s - 60s)"])
+        self.combo_grain.addItems(list(GRAIN_SIZES))
         self.combo_grain.setCurrentIndex(2) 
         h_params.addWidget(self.combo_grain)
+
+        h_params.addWidget(QLabel("Pick:"))
+        self.combo_weighting = QComboBox()
+        self.combo_weighting.addItems(PICK_WEIGHTINGS)
+        h_params.addWidget(self.combo_weighting)
         
         h_params.addWidget(QLabel("Layers:"))
         self.spin_layers = QSpinBox()
@@ -443,6 +959,55 @@ class RndSndApp(QMainWindow):
         
         self.tabs.addTab(tab, "Mixer")
 
+    def setup_diagnostics_tab(self):
+        tab = QWidget()
+        l = QVBoxLayout(tab)
+        
+        l.addWidget(QLabel("<h2>Diagnostics</h2>"))
+        self.diag_table = QTableWidget()
+        self.diag_table.setColumnCount(8)
+        self.diag_table.setHorizontalHeaderLabels(["Stage", "Count", "Total (s)", "Mean (ms)", "p50 (ms)", "p95 (ms)", "Per sec", "MB/s"])
+        self.diag_table.horizontalHeader().setSectionResizeMode(QHeaderView.Stretch)
+        self.diag_table.setEditTriggers(QAbstractItemView.NoEditTriggers)
+        l.addWidget(self.diag_table)
+        
+        self.diag_counters_lbl = QLabel("")
+        self.diag_counters_lbl.setWordWrap(True)
+        l.addWidget(self.diag_counters_lbl)
+        
+        h = QHBoxLayout()
+        btn_reset = QPushButton("♻ RESET")
+        btn_reset.clicked.connect(lambda: (PROFILER.reset(), self.refresh_diagnostics()))
+        btn_json = QPushButton("💾 EXPORT JSON")
+        btn_json.clicked.connect(lambda: self.export_diagnostics("json"))
+        btn_trace = QPushButton("💾 EXPORT CHROME TRACE")
+        btn_trace.clicked.connect(lambda: self.export_diagnostics("trace"))
+        h.addWidget(btn_reset); h.addStretch(); h.addWidget(btn_json); h.addWidget(btn_trace)
+        l.addLayout(h)
+        
+        self.diag_timer = QTimer()
+        self.diag_timer.timeout.connect(self.refresh_diagnostics)
+        self.diag_timer.start(1000)
+        self.tabs.addTab(tab, "Diagnostics")
+
+    def refresh_diagnostics(self):
+        summary = PROFILER.summary()
+        stages = sorted(summary["stages"].items())
+        self.diag_table.setRowCount(len(stages))
+        for row, (name, st) in enumerate(stages):
+            cells = [name, str(st["count"]), f"{st['total_s']:.2f}", f"{st['mean_ms']:.1f}",
+                     f"{st['p50_ms']:.1f}", f"{st['p95_ms']:.1f}", f"{st['per_sec']:.1f}",
+                     f"{st['mb_per_sec']:.1f}" if st["bytes"] else "-"]
+            for col, text in enumerate(cells): self.diag_table.setItem(row, col, QTableWidgetItem(text))
+        self.diag_counters_lbl.setText("  |  ".join(f"{k}: {v}" for k, v in sorted(summary["counters"].items())))
+
+    def export_diagnostics(self, fmt):
+        default = "rndsnd_trace.json" if fmt == "trace" else "rndsnd_profile.json"
+        path, _ = QFileDialog.getSaveFileName(self, "Export Diagnostics", default, "JSON (*.json)")
+        if not path: return
+        try: PROFILER.export(path, fmt)
+        except OSError as e: QMessageBox.warning(self, "Export failed", str(e))
+
     def filter_file_table(self, text):
         text = text.lower()
         for row in range(self.file_table.rowCount()):
@@ -524,28 +1089,26 @@ class RndSndApp(QMainWindow):
         # --- ROBUST LOADING (FIX UBUNTU STUDIO) ---
         print(f"📂 Load attempt: {os.path.basename(path)}")
         try:
-            # TRY 1: SoundFile (Fast, Native)
-            import soundfile as sf
-            data, samplerate = sf.read(path, always_2d=True)
-            if data.shape[1] > 1: self.audio_data = data.mean(axis=1).astype(np.float32)
-            else: self.audio_data = data.flatten().astype(np.float32)
-            self.sr = samplerate
-            self.duration = len(self.audio_data) / self.sr
-            print("✅ Loaded with SoundFile")
-        except Exception as e_sf:
-            print(f"⚠️ SoundFile failed: {e_sf}")
-            try:
-                # TRY 2: Librosa (Fallback)
-                self.audio_data, self.sr = librosa.load(path, sr=None, mono=True)
-                self.duration = len(self.audio_data) / self.sr
-                print("✅ Loaded with Librosa")
-            except Exception as e_lib:
-                print(f"❌ ERROR: {e_lib}")
-                return
+            # Uncompressed files are memory-mapped, the rest decoded once to a temp memmap
+            t = time.perf_counter()
+            buf = open_audio_buffer(path)
+            # Mapping only touches the header, so it gets its own stage and no byte count
+            if buf.mapped: PROFILER.record("load.map", t, time.perf_counter())
+            else: PROFILER.record("load.decode", t, time.perf_counter(), os.path.getsize(path))
+            print(f"✅ Loaded ({'memory-mapped' if buf.mapped else 'decoded to temp memmap'}, {buf.channels} ch)")
+        except Exception as e:
+            print(f"❌ ERROR: {e}")
+            return
+        # The previous buffer is released once no clip render still holds it
+        self.cancel_clip_render()
+        self.audio_buffer = buf
+        self.sr = buf.samplerate
+        self.duration = buf.duration
 
         # Setup Player
         try:
             self.player.setSource(QUrl.fromLocalFile(path))
+            self.current_file = path
             self.is_looping = False
             self.selection_range = (0, 0)
             self.btn_drag.setText("📦 DRAG")
@@ -553,33 +1116,53 @@ class RndSndApp(QMainWindow):
         except Exception as e_gui: print(f"❌ GUI Error: {e_gui}")
 
     def plot_waveform(self):
+        with PROFILER.span("load.waveform_render"): self._plot_waveform()
+
+    def _plot_waveform(self):
         self.ax.clear(); self.ax.set_facecolor(self.canvas_bg); self.figure.patch.set_facecolor(self.canvas_bg)
-        if self.audio_data is not None:
-            downsample = 100 
-            t = np.linspace(0, self.duration, len(self.audio_data[::downsample]))
-            self.ax.plot(t, self.audio_data[::downsample], color=self.wf_color, lw=0.7)
+        self.wave_artists = []
+        if self.audio_buffer is not None:
             self.ax.set_xlim(0, self.duration); self.ax.set_ylim(-1.1, 1.1)
             self.ax.axis('off')
+            self.draw_envelope(0, self.duration)
             self.playhead_line = self.ax.axvline(x=0, color=self.cursor_color, lw=2)
         self.canvas.draw()
 
+    def draw_envelope(self, t0, t1, n_bins=4000):
+        # Only the visible window is read from the buffer. Stereo files get one lane per channel.
+        for a in self.wave_artists: a.remove()
+        self.wave_artists = []
+        buf = self.audio_buffer
+        start, stop = int(t0 * buf.samplerate), min(buf.frames, int(np.ceil(t1 * buf.samplerate)))
+        stereo = buf.channels == 2
+        lo, hi = buf.peaks(n_bins, start, stop, mono=not stereo)
+        if not len(lo): return
+        spb = -(-(stop - start) // n_bins)
+        t = (start + np.arange(len(lo)) * spb) / buf.samplerate
+        lanes = [(0.55, 0.5), (-0.55, 0.5)] if stereo else [(0.0, 1.0)]
+        for i, (center, gain) in enumerate(lanes):
+            self.wave_artists.append(self.ax.fill_between(t, center + gain * lo[:, i], center + gain * hi[:, i], color=self.wf_color, lw=0.7))
+
     def on_scroll_zoom(self, event):
-        if self.audio_data is None or event.inaxes != self.ax: return
+        if self.audio_buffer is None or event.inaxes != self.ax: return
         cur_xlim = self.ax.get_xlim(); scale = 1/1.2 if event.button == 'up' else 1.2
         new_width = (cur_xlim[1] - cur_xlim[0]) * scale
         center = event.xdata if event.xdata else (cur_xlim[0] + cur_xlim[1]) / 2
         new_min = max(0, center - (center - cur_xlim[0]) * scale)
         new_max = min(self.duration, center + (cur_xlim[1] - center) * scale)
-        self.ax.set_xlim([new_min, new_max]); self.canvas.draw_idle()
+        self.ax.set_xlim([new_min, new_max])
+        with PROFILER.span("load.waveform_render"): self.draw_envelope(new_min, new_max)
+        self.canvas.draw_idle()
 
     def on_select(self, xmin, xmax):
         self.selection_range = (xmin, xmax); self.is_looping = True; self.btn_drag.setText(f"📦 {xmax-xmin:.1f}s")
+        self.clip_timer.start(250)
         if self.player.playbackState() == QMediaPlayer.PlayingState:
             pos_sec = self.player.position() / 1000.0
             if pos_sec < xmin or pos_sec > xmax: self.player.setPosition(int(xmin * 1000))
 
     def on_mouse_click(self, event):
-        if event.inaxes != self.ax or self.audio_data is None: return
+        if event.inaxes != self.ax or self.audio_buffer is None: return
         if event.button == 1:
             click_time = max(0, min(event.xdata, self.duration))
             self.player.setPosition(int(click_time * 1000))
@@ -606,35 +1189,82 @@ class RndSndApp(QMainWindow):
     
     def seek_relative(self, ms): self.player.setPosition(max(0, self.player.position() + ms))
 
-    def start_drag_operation(self):
-        if self.audio_data is None: return
+    def current_clip_key(self):
+        if self.audio_buffer is None or not self.current_file: return None
         s, e = (self.selection_range if self.is_looping else (0, self.duration))
-        chunk = self.audio_data[int(s*self.sr):int(e*self.sr)]
-        tp = os.path.join(tempfile.gettempdir(), f"rnd_{int(time.time())}.wav")
-        sf.write(tp, chunk, self.sr)
+        start, stop = max(0, int(s*self.sr)), min(self.audio_buffer.frames, int(e*self.sr))
+        if stop <= start: return None
+        return (self.current_file, start, stop)
+
+    def cancel_clip_render(self):
+        # At most one render runs; a stale one stops at its next block
+        if self.clip_worker and self.clip_worker.isRunning():
+            self.clip_worker.cancel()
+            self.clip_worker.wait()
+        self.clip_worker = None
+
+    def prerender_drag_clip(self):
+        # Only selections are rendered; without one the source file itself is dragged
+        if not self.is_looping: return
+        key = self.current_clip_key()
+        if key is None or self.clip_cache.get(key): return
+        if self.clip_worker and self.clip_worker.key == key and self.clip_worker.isRunning(): return
+        self.cancel_clip_render()
+        self.clip_worker = ClipRenderWorker(key, self.clip_cache.clip_path(key), self.audio_buffer)
+        self.clip_worker.rendered.connect(self.on_clip_rendered)
+        self.clip_worker.failed.connect(self.on_clip_failed)
+        self.clip_worker.start()
+
+    def on_clip_rendered(self, key, tp):
+        self.clip_cache.put(key, tp)
+        if key == self.current_clip_key(): self.btn_drag.setText(f"📦 {(key[2]-key[1])/self.sr:.1f}s")
+
+    def on_clip_failed(self, key):
+        if key == self.current_clip_key(): self.btn_drag.setText("⚠️ FAILED")
+
+    def start_drag_operation(self):
+        if self.audio_buffer is None or not self.current_file: return
+        if not self.is_looping:
+            # No selection: the export would be identical to the source, so drag the source
+            tp = self.current_file
+        else:
+            key = self.current_clip_key()
+            if key is None: return
+            tp = self.clip_cache.get(key)
+            if tp is None:
+                # Not rendered yet: never block the GUI, start (or keep) the background render
+                self.clip_timer.stop()
+                self.prerender_drag_clip()
+                self.btn_drag.setText("⏳ RENDERING")
+                return
         drag = QDrag(self.btn_drag); mime = QMimeData(); mime.setUrls([QUrl.fromLocalFile(tp)])
         drag.setMimeData(mime); drag.setPixmap(QPixmap(32, 32)); drag.exec_(Qt.CopyAction)
 
     def generate_mix(self):
+        with PROFILER.span("mix.total"): self._generate_mix()
+
+    def _generate_mix(self):
         if not os.path.exists("output"): os.makedirs("output")
         timestamp = datetime.datetime.now().strftime('%Y%m%d_%H%M%S')
         fname = f"rndsnd_mix_{timestamp}"; ext = "mp3"
         
-        conn = sqlite3.connect(DB_PATH); cur = conn.cursor()
-        
-        if self.radio_tags.isChecked():
-            src = []
-            for row in range(self.file_table.rowCount()):
-                if not self.file_table.isRowHidden(row):
-                    path = self.file_table.item(row, 0).data(Qt.UserRole)
-                    src.append(path)
-        else:
-            cur.execute("SELECT path FROM files")
-            src = [x[0] for x in cur.fetchall()]
-        
-        conn.close()
+        grain_mode = self.combo_grain.currentText()
+        min_ms, max_ms = GRAIN_SIZES[grain_mode]
+
+        if self.radio_tags.isChecked() and not self.current_browsing_path:
+            # Filtered mode mixes the browsed folder; with none browsed the list is empty
+            self.status_lbl.setText("❌ No files found (Check filter or DB).")
+            return
+
+        with PROFILER.span("mix.index"):
+            if self.radio_tags.isChecked():
+                index = MixCandidateIndex.from_db(DB_PATH, self.current_browsing_path, self.search_bar.text(),
+                                                  min_ms / 1000.0, self.combo_weighting.currentText())
+            else:
+                index = MixCandidateIndex.from_db(DB_PATH, min_sec=min_ms / 1000.0, weighting=self.combo_weighting.currentText(),
+                                                  tag_text=self.search_bar.text())
             
-        if not src: 
+        if not len(index): 
             self.status_lbl.setText("❌ No files found (Check filter or DB).")
             return
 
@@ -643,44 +1273,38 @@ class RndSndApp(QMainWindow):
         target_duration_ms = self.spin_dur.value() * 1000
         num_layers = self.spin_layers.value()
         used_files_log = []
-        
-        # --- DETERMINE GRAIN SIZE ---
-        grain_mode = self.combo_grain.currentText()
-        if "Micro" in grain_mode: min_ms, max_ms = 200, 2000
-        elif "Short" in grain_mode: min_ms, max_ms = 2000, 5000
-        elif "Medium" in grain_mode: min_ms, max_ms = 5000, 15000
-        elif "Long" in grain_mode: min_ms, max_ms = 15000, 30000
-        else: min_ms, max_ms = 30000, 60000
-        # ----------------------------
 
         def fmt_ms(ms): return f"{int(ms/1000/60):02d}:{int(ms/1000)%60:02d}"
 
+        def next_grain():
+            # Returns (path, start_ms, seg), or None once every candidate failed to decode
+            while len(index):
+                chosen_file = index.pick()
+                start_pos, clip_len = index.random_clip(chosen_file, min_ms, max_ms)
+                try: return chosen_file, start_pos, load_grain(chosen_file, start_pos, clip_len)
+                except Exception as e:
+                    print(f"⚠️ Skipping undecodable file {os.path.basename(chosen_file)}: {e}")
+                    PROFILER.count("mix.bad_files")
+                    index.mark_bad(chosen_file)
+            return None
+
         if num_layers == 1:
             # Linear DJ Mode
             mix = AudioSegment.silent(duration=0)
             crossfade_time = 2000
             
             while len(mix) < target_duration_ms:
-                try:
-                    chosen_file = random.choice(src)
-                    a = AudioSegment.from_file(chosen_file)
+                grain = next_grain()
+                if grain is None: break
+                chosen_file, start_pos, seg = grain
                     
-                    clip_len = random.randint(min_ms, max_ms)
-                    
-                    start_pos = 0
-                    if len(a) < clip_len: seg = a
-                    else:
-                        start_pos = random.randint(0, len(a) - clip_len)
-                        seg = a[start_pos:start_pos+clip_len]
-                        
-                    seg = seg.fade_in(50).fade_out(50)
-                    
-                    if len(mix) == 0: mix = seg
-                    else: mix = mix.append(seg, crossfade=min(len(mix), len(seg), crossfade_time))
-                    
-                    timecode = f"{fmt_ms(start_pos)}-{fmt_ms(start_pos+len(seg))}"
-                    used_files_log.append(f"Track: {os.path.basename(chosen_file)} [{timecode}]")
-                except: continue
+                seg = seg.fade_in(50).fade_out(50)
+                
+                if len(mix) == 0: mix = seg
+                else: mix = mix.append(seg, crossfade=min(len(mix), len(seg), crossfade_time))
+                
+                timecode = f"{fmt_ms(start_pos)}-{fmt_ms(start_pos+len(seg))}"
+                used_files_log.append(f"Track: {os.path.basename(chosen_file)} [{timecode}]")
             
             base_mix = mix[:target_duration_ms]
             
@@ -691,35 +1315,32 @@ class RndSndApp(QMainWindow):
                 layer_audio = AudioSegment.silent(duration=target_duration_ms)
                 current_pos = 0
                 while current_pos < target_duration_ms:
-                    try:
-                        chosen_file = random.choice(src)
-                        a = AudioSegment.from_file(chosen_file)
-                        
-                        clip_len = random.randint(min_ms, max_ms)
-                        
-                        start_pos = 0
-                        if len(a) < clip_len: seg = a
-                        else:
-                            start_pos = random.randint(0, len(a) - clip_len)
-                            seg = a[start_pos:start_pos+clip_len]
-                        
-                        seg = seg.fade_in(100).fade_out(100)
-                        seg = seg.pan(random.uniform(-0.5, 0.5))
-                        seg = seg - random.uniform(0, 6) 
-                        
-                        if current_pos + len(seg) > target_duration_ms:
-                            seg = seg[:target_duration_ms - current_pos]
-                        
-                        layer_audio = layer_audio.overlay(seg, position=current_pos)
-                        
-                        timecode = f"{fmt_ms(start_pos)}-{fmt_ms(start_pos+len(seg))}"
-                        used_files_log.append(f"Layer {layer_idx+1}: {os.path.basename(chosen_file)} [{timecode}]")
-                        
-                        current_pos += len(seg)
-                    except: continue
+                    grain = next_grain()
+                    if grain is None: break
+                    chosen_file, start_pos, seg = grain
+                    
+                    seg = seg.fade_in(100).fade_out(100)
+                    seg = seg.pan(random.uniform(-0.5, 0.5))
+                    seg = seg - random.uniform(0, 6) 
+                    
+                    if current_pos + len(seg) > target_duration_ms:
+                        seg = seg[:target_duration_ms - current_pos]
+                    
+                    layer_audio = layer_audio.overlay(seg, position=current_pos)
+                    
+                    timecode = f"{fmt_ms(start_pos)}-{fmt_ms(start_pos+len(seg))}"
+                    used_files_log.append(f"Layer {layer_idx+1}: {os.path.basename(chosen_file)} [{timecode}]")
+                    
+                    current_pos += len(seg)
                 base_mix = base_mix.overlay(layer_audio)
 
-        base_mix.export(f"output/{fname}.{ext}", format=ext)
+        if not used_files_log:
+            self.status_lbl.setText("❌ None of the candidate files could be decoded.")
+            return
+
+        PROFILER.count("mix.grains", len(used_files_log))
+        with PROFILER.span("mix.encode"):
+            base_mix.export(f"output/{fname}.{ext}", format=ext)
         
         try:
             with open(f"output/{fname}.txt", "w", encoding="utf-8") as f:
@@ -730,6 +1351,17 @@ class RndSndApp(QMainWindow):
             
         self.status_lbl.setText(f"✅ Created: {fname}.{ext} + Log")
 
+    def closeEvent(self, event):
+        out = os.environ.get("RNDSND_PROFILE_OUT")
+        if PROFILER.enabled and out:
+            try: PROFILER.export(out, "trace")
+            except OSError as e: print(f"⚠️ Could not write profile: {e}")
+        self.clip_timer.stop()
+        self.cancel_clip_render()
+        self.clip_cache.clear()
+        if self.audio_buffer is not None: self.audio_buffer.close()
+        super().closeEvent(event)
+
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     app.setStyle("Fusion")
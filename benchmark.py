@@ -0,0 +1,308 @@
+"""rndsnd benchmark suite.
+
+Generates a reproducible synthetic sample library and times the hot paths of
+app_desktop.py: scanning, DB folder queries / search, waveform load + plot and
+the generative mixer (linear and chaos). Results are written as JSON and can be
+compared against a saved baseline.
+
+    python benchmark.py --files 200 --out bench.json --save-baseline baseline.json
+    python benchmark.py --files 200 --baseline baseline.json   # exit code 1 on regression
+"""
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import platform
+import tempfile
+import statistics
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+import soundfile as sf
+
+import app_desktop as app
+
+ORIG_CWD = os.getcwd()
+
+# --- SYNTHETIC LIBRARY ---
+# (extension, soundfile format, subtype)
+FORMATS = [("wav", "WAV", "PCM_16"), ("wav", "WAV", "PCM_24"), ("flac", "FLAC", "PCM_16"), ("ogg", "OGG", "VORBIS")]
+SAMPLE_RATES = [22050, 32000, 44100, 48000, 96000]
+# Weighted duration buckets in seconds: lots of one-shots, some loops, a few long recordings
+DURATIONS = [((0.2, 2.0), 5), ((2.0, 10.0), 4), ((10.0, 45.0), 2), ((45.0, 180.0), 1)]
+
+def pick_duration(rng, max_duration):
+    buckets, weights = zip(*DURATIONS)
+    lo, hi = buckets[rng.choices(range(len(buckets)), weights=weights)[0]]
+    return min(rng.uniform(lo, hi), max_duration)
+
+def synth_signal(rng, frames, sr, channels):
+    t = np.arange(frames, dtype=np.float32) / sr
+    out = np.empty((frames, channels), dtype=np.float32)
+    for c in range(channels):
+        freq = rng.uniform(40, 4000)
+        tone = np.sin(2 * np.pi * freq * t) * rng.uniform(0.1, 0.5)
+        noise = np.random.default_rng(rng.randrange(1 << 30)).standard_normal(frames).astype(np.float32) * rng.uniform(0.0, 0.2)
+        out[:, c] = tone + noise
+    return np.clip(out, -1.0, 1.0)
+
+def make_library(folder, n_files, seed=1234, max_duration=180.0):
+    """Writes n_files synthetic samples spread over a few sub-folders. Returns the file list."""
+    rng = random.Random(seed)
+    paths = []
+    for i in range(n_files):
+        ext, fmt, subtype = rng.choice(FORMATS)
+        sr = rng.choice(SAMPLE_RATES)
+        channels = rng.choice([1, 2, 2])
+        dur = pick_duration(rng, max_duration)
+        sub = os.path.join(folder, f"pack_{i % 8:02d}")
+        os.makedirs(sub, exist_ok=True)
+        path = os.path.join(sub, f"sample_{i:05d}.{ext}")
+        sf.write(path, synth_signal(rng, max(1, int(dur * sr)), sr, channels), sr, format=fmt, subtype=subtype)
+        paths.append(path)
+    return paths
+
+def count_library(folder):
+    """Files actually on disk: a reused --workdir may hold a library of a different size."""
+    exts = tuple(f".{ext}" for ext, _, _ in FORMATS)
+    return sum(f.endswith(exts) for _, _, files in os.walk(folder) for f in files)
+
+def make_synthetic_db(db_path, n_rows, seed=1234):
+    """Fills a DB with n_rows fake catalog entries (no audio files behind them)."""
+    rng = random.Random(seed)
+    words = ["Piano", "Rain", "Drum", "Synthesizer", "Speech", "Wind", "Bird", "Guitar", "Noise", "Engine", "Bell", "Water"]
+    app.create_schema(db_path)
+    conn = sqlite3.connect(db_path)
+    def rows():
+        for i in range(n_rows):
+            folder = f"/library/drive_{i % 4}/pack_{i % 500:03d}"
+            tags = ", ".join(rng.sample(words, 3))
+            yield (f"sample_{i:07d}.wav", f"{folder}/sample_{i:07d}.wav", folder, tags,
+                   rng.randint(10_000, 50_000_000), rng.uniform(0.2, 300.0), rng.choice(SAMPLE_RATES), 1)
+    conn.executemany("INSERT INTO files (filename, path, folder, tags, size, duration, samplerate, decodable) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows())
+    conn.commit(); conn.close()
+
+# --- STUB TAGGER ---
+class StubTagger:
+    """Stands in for PANNs when the Cnn14 weights are not downloaded. Deterministic, near-zero cost."""
+    labels = [f"Stub Label {i}" for i in range(527)]
+
+    def __init__(self, checkpoint_path=None, device='cpu'):
+        self.rng = np.random.default_rng(0)
+
+    def inference(self, y):
+        return self.rng.random((1, len(self.labels)), dtype=np.float32), None
+
+def panns_weights_present():
+    return os.path.exists(os.path.join(os.path.expanduser("~"), "panns_data", "Cnn14_mAP=0.431.pth"))
+
+def install_tagger(use_stub):
+    if use_stub:
+        app.AudioTagging = StubTagger
+        app.AI_AVAILABLE = True
+    return "stub" if use_stub else ("panns" if app.AI_AVAILABLE else "none")
+
+# --- TIMING ---
+def measure(fn, repeat, setup=None):
+    times = []
+    for _ in range(repeat):
+        if setup: setup()
+        t = time.perf_counter(); fn(); times.append(time.perf_counter() - t)
+    times.sort()
+    return {"runs": repeat, "min_s": times[0], "median_s": statistics.median(times),
+            "p95_s": times[min(len(times) - 1, int(0.95 * len(times)))]}
+
+def with_profile(result):
+    result["stages"] = app.PROFILER.summary()["stages"]
+    app.PROFILER.reset()
+    return result
+
+# --- BENCHMARKS ---
+def bench_scan(lib_folder, work, n_files, repeat):
+    db_path = os.path.join(work, "scan.db")
+    def setup():
+        if os.path.exists(db_path): os.remove(db_path)
+        app.create_schema(db_path)
+        app.DB_PATH = db_path
+    def run(): app.ScanWorker(lib_folder).run()
+    app.PROFILER.reset()
+    res = measure(run, repeat, setup)
+    res["files_per_s"] = n_files / res["median_s"]
+    return {"scan": with_profile(res)}, db_path
+
+def synthetic_db(work, n, seed):
+    db_path = os.path.join(work, f"synthetic_{n}.db")
+    if not os.path.exists(db_path): make_synthetic_db(db_path, n, seed)
+    return db_path
+
+def bench_db(work, sizes, repeat, seed):
+    results = {}
+    for n in sizes:
+        db_path = synthetic_db(work, n, seed)
+        folder = "/library/drive_1/pack_017"
+        conn = sqlite3.connect(db_path)
+        def folder_query():
+            conn.execute("SELECT filename, tags, duration, size, path FROM files WHERE path LIKE ?", (folder + "%",)).fetchall()
+        def mix_search():
+            app.MixCandidateIndex.from_db(db_path, search_text="rain")
+        def index_full():
+            app.MixCandidateIndex.from_db(db_path, min_sec=5.0, weighting="Duration")
+        results[f"db.folder_query.{n}"] = measure(folder_query, repeat)
+        results[f"db.mix_search.{n}"] = measure(mix_search, repeat)
+        results[f"db.mix_index.{n}"] = measure(index_full, max(1, repeat // 2))
+        conn.close()
+    return results
+
+def bench_table_search(win, work, sizes, repeat, seed):
+    """The search users actually run: load a folder into the Qt table, then filter it in memory."""
+    results = {}
+    saved_db = app.DB_PATH
+    try:
+        for n in sizes:
+            app.DB_PATH = synthetic_db(work, n, seed)
+            folder = "/library/drive_1"  # a quarter of the rows
+            results[f"ui.table_populate.{n}"] = measure(lambda: win.update_table_from_db(folder), max(1, repeat // 3))
+            def search():
+                win.filter_file_table("rain")
+                win.filter_file_table("")
+            results[f"ui.search.{n}"] = measure(search, repeat)
+            win.file_table.setRowCount(0)
+    finally:
+        app.DB_PATH = saved_db
+    return results
+
+def bench_waveform(win, lib_folder, repeat):
+    win.update_table_from_db(lib_folder)
+    # Longest files stress load + plot the most
+    rows = sorted(range(win.file_table.rowCount()),
+                  key=lambda r: sf.info(win.file_table.item(r, 0).data(app.Qt.UserRole)).duration, reverse=True)[:5]
+    def run():
+        for r in rows: win.load_selected_file(win.file_table.item(r, 0))
+    app.PROFILER.reset()
+    res = measure(run, repeat)
+    res["files"] = len(rows)
+    return {"waveform.load_plot": with_profile(res)}
+
+def bench_mix(win, mix_duration, repeat, seed):
+    results = {}
+    win.radio_chaos.setChecked(True)
+    win.spin_dur.setValue(mix_duration)
+    def setup(): random.seed(seed)
+    def run():
+        win.generate_mix()
+        # An early return ("No files found", nothing decodable) must not be timed as a fast mix
+        if not win.status_lbl.text().startswith("✅"):
+            raise RuntimeError(f"generate_mix did not create a file: {win.status_lbl.text()}")
+    for name, layers in (("linear", 1), ("chaos", 4)):
+        win.spin_layers.setValue(layers)
+        app.PROFILER.reset()
+        results[f"mix.{name}"] = with_profile(measure(run, repeat, setup))
+    return results
+
+# --- BASELINE COMPARISON ---
+def compare(results, baseline, tolerance, meta=None):
+    """Prints a median-vs-baseline table. Returns the names of benchmarks slower than tolerance."""
+    regressions = []
+    base_meta = baseline.get("meta", {})
+    for key in ("files", "seed", "mix_duration", "tagger"):
+        if meta and key in base_meta and base_meta[key] != meta.get(key):
+            print(f"⚠️ Baseline {key}={base_meta[key]!r} but this run has {key}={meta.get(key)!r}: timings are not comparable")
+    print(f"\n{'benchmark':<32}{'baseline':>12}{'current':>12}{'ratio':>8}")
+    for name, res in sorted(results.items()):
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            print(f"{name:<32}{'-':>12}{res['median_s']:>11.4f}s{'new':>8}")
+            continue
+        ratio = res["median_s"] / base["median_s"] if base["median_s"] > 0 else float("inf")
+        flag = " !" if ratio > 1 + tolerance else ""
+        if flag: regressions.append(name)
+        print(f"{name:<32}{base['median_s']:>11.4f}s{res['median_s']:>11.4f}s{ratio:>7.2f}x{flag}")
+    return regressions
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="rndsnd benchmark suite")
+    ap.add_argument("--files", type=int, default=200, help="synthetic library size")
+    ap.add_argument("--max-duration", type=float, default=180.0, help="longest synthetic file (s)")
+    ap.add_argument("--db-rows", default="10000,100000,1000000", help="comma-separated synthetic DB sizes")
+    ap.add_argument("--mix-duration", type=int, default=30, help="mix length (s)")
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--seed", type=int, default=1234)
+    ap.add_argument("--skip", default="", help="comma-separated: scan,db,waveform,mix")
+    ap.add_argument("--stub-tagger", action="store_true", help="use the stub tagger even if PANNs weights exist")
+    ap.add_argument("--workdir", help="where to keep the library and DBs (default: new temp dir)")
+    ap.add_argument("--out", help="write results JSON here")
+    ap.add_argument("--baseline", help="compare against this results JSON")
+    ap.add_argument("--save-baseline", help="also write results to this path as the new baseline")
+    ap.add_argument("--tolerance", type=float, default=0.10, help="allowed slowdown vs baseline (0.10 = 10%%)")
+    args = ap.parse_args(argv)
+
+    skip = set(filter(None, args.skip.split(",")))
+    work = os.path.abspath(args.workdir or tempfile.mkdtemp(prefix="rndsnd_bench_"))
+    lib_folder = os.path.join(work, "library")
+    os.makedirs(work, exist_ok=True)
+    os.chdir(work)  # generate_mix writes into ./output
+
+    app.PROFILER.enabled = True
+    tagger = install_tagger(args.stub_tagger or not panns_weights_present())
+
+    if not os.path.isdir(lib_folder):
+        print(f"Generating {args.files} synthetic files in {lib_folder}...")
+        make_library(lib_folder, args.files, args.seed, args.max_duration)
+    n_files = count_library(lib_folder)
+    if n_files != args.files: print(f"⚠️ Reusing a library of {n_files} files (--files {args.files} ignored)")
+
+    results = {}
+    scan_db = os.path.join(work, "scan.db")
+    if "scan" not in skip:
+        print("Benchmarking scan...")
+        res, scan_db = bench_scan(lib_folder, work, n_files, 1 if tagger == "panns" else args.repeat)
+        results.update(res)
+    elif not os.path.exists(scan_db):
+        app.create_schema(scan_db); app.DB_PATH = scan_db; app.ScanWorker(lib_folder).run()
+    app.DB_PATH = scan_db
+
+    db_sizes = [int(x) for x in args.db_rows.split(",") if x]
+    if "db" not in skip:
+        print("Benchmarking DB queries...")
+        results.update(bench_db(work, db_sizes, args.repeat * 3, args.seed))
+
+    if not {"db", "waveform", "mix"} <= skip:
+        qt_app = app.QApplication.instance() or app.QApplication(sys.argv[:1])  # noqa: F841 (must stay alive)
+        win = app.RndSndApp()
+        if "db" not in skip:
+            print("Benchmarking table search...")
+            results.update(bench_table_search(win, work, db_sizes, args.repeat * 3, args.seed))
+        if "waveform" not in skip:
+            print("Benchmarking waveform load/plot...")
+            results.update(bench_waveform(win, lib_folder, args.repeat))
+        if "mix" not in skip:
+            print("Benchmarking mixer...")
+            results.update(bench_mix(win, args.mix_duration, args.repeat, args.seed))
+        win.close()
+
+    report = {
+        "meta": {"date": time.strftime("%Y-%m-%dT%H:%M:%S"), "python": platform.python_version(),
+                 "platform": platform.platform(), "files": n_files, "seed": args.seed, "tagger": tagger,
+                 "repeat": args.repeat, "mix_duration": args.mix_duration},
+        "results": results,
+    }
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(os.path.join(ORIG_CWD, path), "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=1)
+    if not args.out: print(json.dumps(report, indent=1))
+
+    if args.baseline:
+        with open(os.path.join(ORIG_CWD, args.baseline), encoding="utf-8") as f: baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance, report["meta"])
+        if regressions:
+            print(f"\n❌ {len(regressions)} regression(s) beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            return 1
+        print("\n✅ No regressions.")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())